@@ -1,20 +1,44 @@
 import argparse
+import functools
+import io
 import logging
 import os
+import queue
 import shutil
 import sys
 import re
-from concurrent.futures import ProcessPoolExecutor, as_completed
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
+from multiprocessing import shared_memory
 from pathlib import Path
-from typing import Optional, Tuple
+from typing import Optional, Tuple, Union
 
-from PIL import Image, ImageOps
+import PIL
+from PIL import Image
+
+# Optional: NumPy for sharing the decoded watermark with workers
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Optional: libjpeg-turbo encoder via PyTurboJPEG (falls back to Pillow)
+try:
+    from turbojpeg import TJPF_RGB, TJSAMP_420, TurboJPEG
+except ImportError:
+    TurboJPEG = None
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(message)s')
 logger = logging.getLogger(__name__)
 
 SUPPORTED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tiff', '.webp'}
+# Metadata carried over to the output; other info keys are not forwarded to save()
+METADATA_KEYS = ('exif', 'icc_profile', 'dpi', 'xmp')
+# Per-format encoder settings read back from info so the output matches the source
+FORMAT_SAVE_KEYS = {'TIFF': ('compression',), 'JPEG': ('comment',), 'GIF': ('comment',)}
+# Windows drive letter prefix, e.g. C:/
+_DRIVE_RE = re.compile(r'^([a-zA-Z]):/')
 
 def convert_windows_to_linux_path(path_input: str) -> Path:
     """
@@ -29,8 +53,7 @@ def convert_windows_to_linux_path(path_input: str) -> Path:
     linux_path_str = path_str.replace('\\', '/')
     
     # Handle drive letters (e.g., C:/ -> /mnt/c/)
-    drive_letter_pattern = re.compile(r'^([a-zA-Z]):/')
-    linux_path_str = drive_letter_pattern.sub(
+    linux_path_str = _DRIVE_RE.sub(
         lambda match: f'/mnt/{match.group(1).lower()}/', 
         linux_path_str
     )
@@ -42,103 +65,312 @@ def get_path(path_str: str) -> Path:
          return convert_windows_to_linux_path(path_str)
     return Path(path_str)
 
+# Shared-memory watermark handle: (segment name, array shape, dtype string)
+WatermarkHandle = Tuple[str, Tuple[int, ...], str]
+
+# Segments attached by this worker; kept referenced while images use them
+_attached_segments = []
+
+def _share_watermark(path: Path) -> Tuple[shared_memory.SharedMemory, WatermarkHandle]:
+    """
+    Decodes the watermark once in the parent and copies the RGBA pixels into
+    shared memory. The caller must close() and unlink() the returned segment.
+    """
+    with Image.open(path) as wm:
+        arr = np.asarray(wm.convert("RGBA"))
+    shm = shared_memory.SharedMemory(create=True, size=arr.nbytes)
+    np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[...] = arr
+    return shm, (shm.name, arr.shape, arr.dtype.str)
+
+@functools.lru_cache(maxsize=4)
+def _load_watermark(source: Union[str, WatermarkHandle]) -> Image.Image:
+    """
+    Loads the watermark as RGBA once per worker process and caches it.
+    source is a file path, or a handle from _share_watermark which is
+    mapped without decoding or copying.
+    """
+    if isinstance(source, tuple):
+        name, shape, dtype = source
+        shm = shared_memory.SharedMemory(name=name)
+        _attached_segments.append(shm)
+        return Image.fromarray(np.ndarray(shape, dtype=dtype, buffer=shm.buf))
+
+    with Image.open(source) as wm:
+        wm_base = wm.convert("RGBA")
+    wm_base.load()
+    return wm_base
+
+@functools.lru_cache(maxsize=8)
+def _opacity_lut(opacity: float) -> Tuple[int, ...]:
+    """Builds the 256-entry alpha lookup table for the given opacity."""
+    return tuple(int(p * opacity) for p in range(256))
+
+@functools.lru_cache(maxsize=64)
+def _layout(width: int, ratio: float) -> Tuple[int, int]:
+    """Returns (watermark target width, margin) for a canvas of the given width."""
+    return int(width * ratio), int(width * 0.02)
+
+@functools.lru_cache(maxsize=32)
+def _prepare_watermark(source: Union[str, WatermarkHandle], target_width: int, opacity: float) -> Image.Image:
+    """
+    Returns the watermark resized to fit target_width and faded to opacity.
+    Cached per size, so images sharing dimensions reuse the same result.
+    The returned image is shared and must be treated as read-only.
+    """
+    wm_base = _load_watermark(source)
+
+    # Fit within a target_width square without upscaling, like thumbnail(),
+    # but resize() returns a new image so the cached base needs no copy.
+    scale = min(target_width / wm_base.width, target_width / wm_base.height, 1.0)
+    size = (max(1, round(wm_base.width * scale)), max(1, round(wm_base.height * scale)))
+    if size != wm_base.size:
+        wm_resized = wm_base.resize(size, Image.Resampling.LANCZOS)
+    elif opacity < 1.0:
+        wm_resized = wm_base.copy()  # putalpha() below must not touch the cache
+    else:
+        wm_resized = wm_base
+
+    if opacity < 1.0:
+        alpha = wm_resized.getchannel('A')
+        new_alpha = alpha.point(_opacity_lut(opacity))
+        wm_resized.putalpha(new_alpha)
+    return wm_resized
+
+@functools.lru_cache(maxsize=1)
+def _get_turbojpeg():
+    """Returns a per-worker TurboJPEG encoder, or None if it is unavailable."""
+    if TurboJPEG is None:
+        return None
+    try:
+        return TurboJPEG()
+    except (OSError, RuntimeError) as e:
+        # PyTurboJPEG is installed but libturbojpeg is missing, or too old
+        # for it (PyTurboJPEG 2.x needs libjpeg-turbo >= 3.0)
+        logger.debug(f"turbojpeg unavailable, falling back to Pillow: {e}")
+        return None
+
+# Largest ICC chunk per APP2 segment: 65535 minus length, tag and sequence bytes
+_ICC_CHUNK_SIZE = 65519
+
+def _add_jpeg_metadata(
+    jpeg_bytes: bytes, exif: bytes, icc_profile: bytes, dpi: Optional[Tuple],
+    comment: bytes = b''
+) -> bytes:
+    """
+    Writes dpi into the JFIF header and splices EXIF (APP1), ICC profile
+    (APP2) and comment (COM) segments after it.
+    """
+    data = bytearray(jpeg_bytes)
+    pos = 2  # after SOI
+    if data[2:4] == b'\xff\xe0':
+        if dpi and data[6:11] == b'JFIF\x00':
+            data[13] = 1  # density units: dots per inch
+            data[14:16] = int(round(dpi[0])).to_bytes(2, 'big')
+            data[16:18] = int(round(dpi[1])).to_bytes(2, 'big')
+        pos = 4 + int.from_bytes(data[4:6], 'big')
+
+    segments = b''
+    if exif:
+        if not exif.startswith(b'Exif\x00\x00'):
+            exif = b'Exif\x00\x00' + exif
+        segments += b'\xff\xe1' + (len(exif) + 2).to_bytes(2, 'big') + exif
+    if icc_profile:
+        chunks = [icc_profile[i:i + _ICC_CHUNK_SIZE] for i in range(0, len(icc_profile), _ICC_CHUNK_SIZE)]
+        for seq, chunk in enumerate(chunks, 1):
+            payload = b'ICC_PROFILE\x00' + bytes((seq, len(chunks))) + chunk
+            segments += b'\xff\xe2' + (len(payload) + 2).to_bytes(2, 'big') + payload
+    if comment:
+        segments += b'\xff\xfe' + (len(comment) + 2).to_bytes(2, 'big') + comment
+    data[pos:pos] = segments
+    return bytes(data)
+
+def _encode_jpeg_turbo(image: Image.Image, save_kwargs: dict) -> Optional[bytes]:
+    """
+    Encodes an RGB image with libjpeg-turbo.
+    Returns None if Pillow should encode it instead.
+    """
+    tj = _get_turbojpeg()
+    exif = save_kwargs.get('exif') or b''
+    icc_profile = save_kwargs.get('icc_profile') or b''
+    comment = save_kwargs.get('comment') or b''
+    if isinstance(comment, str):
+        comment = comment.encode()
+    # XMP isn't spliced in here, so leave those files to Pillow
+    if (tj is None or image.mode != 'RGB' or 'xmp' in save_kwargs
+            or len(exif) > 65527 or len(icc_profile) > 255 * _ICC_CHUNK_SIZE
+            or len(comment) > 65533):
+        return None
+
+    try:
+        jpeg_bytes = tj.encode(
+            np.asarray(image),
+            quality=save_kwargs['quality'],
+            pixel_format=TJPF_RGB,
+            jpeg_subsample=TJSAMP_420
+        )
+    except (TypeError, ValueError, NotImplementedError, OSError) as e:
+        # Incompatible PyTurboJPEG/libturbojpeg build; Pillow can still write it
+        logger.debug(f"turbojpeg encode failed, falling back to Pillow: {e}")
+        return None
+    return _add_jpeg_metadata(jpeg_bytes, exif, icc_profile, save_kwargs.get('dpi'), comment)
+
+def _write_file(path: Path, data) -> None:
+    """Writes encoded bytes with a raw fd, skipping Python's buffered I/O layer."""
+    flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0)
+    fd = os.open(str(path), flags, 0o666)  # Same as open(): 0o666 & ~umask
+    try:
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]
+    finally:
+        os.close(fd)
+
+def _palettize_with_transparency(image: Image.Image) -> Tuple[Image.Image, int]:
+    """
+    Converts an RGBA image to P, giving fully transparent pixels their own
+    palette index. Returns the image and that index.
+    """
+    transparent_mask = image.getchannel('A').point([255] + [0] * 255)
+    p_image = image.convert("RGB").quantize(255)
+    palette = p_image.getpalette() or []
+    p_image.putpalette((palette + [0] * 768)[:768])
+    p_image.paste(255, mask=transparent_mask)
+    return p_image, 255
+
 def process_file(
     file_path: Path,
     output_dir: Path,
-    watermark_path: Optional[Path],
+    watermark: Union[Path, WatermarkHandle, None],
     watermark_config: dict,
     border_color: str,
     jpeg_quality: int,
-    delete_original: bool
+    delete_original: bool,
+    max_edge: Optional[int] = None,
+    file_bytes: Optional[bytes] = None
 ) -> str:
     """
     Worker function to process a single image.
+    watermark is a file path or a shared-memory handle from _share_watermark.
+    If file_bytes is given it is decoded instead of reading file_path from disk.
     """
     try:
         # Skip if it looks like a processed file (simple check to avoid recursion if output is same dir)
         if "_1x1" in file_path.stem:
             return f"Skipped (already processed): {file_path.name}"
 
-        with Image.open(file_path) as img:
-            # Preserve metadata
-            metadata = img.info.copy()
+        output_format = Image.registered_extensions()[file_path.suffix.lower()]
+        source = io.BytesIO(file_bytes) if file_bytes is not None else file_path
+        with Image.open(source) as img:
+            # Preserve metadata and format-specific encoder settings
+            keep_keys = METADATA_KEYS + FORMAT_SAVE_KEYS.get(output_format, ())
+            metadata = {k: img.info[k] for k in keep_keys if k in img.info}
+            transparency = img.info.get('transparency')
             original_mode = img.mode
+
+            # Optionally cap the output size. For JPEGs, draft() lets libjpeg
+            # downscale during decode, so we never decode the full resolution.
+            if max_edge:
+                if img.format == "JPEG":
+                    img.draft("RGB", (max_edge, max_edge))
+                if max(img.size) > max_edge:
+                    img.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
             
+            # Decide modes up front so each image is converted at most twice:
+            # once into the working mode, once into the mode it is saved in.
+            is_jpeg = file_path.suffix.lower() in ['.jpg', '.jpeg']
+            if watermark:
+                # JPEGs don't support RGBA; other formats keep their original mode
+                save_mode = "RGB" if is_jpeg else original_mode
+                # The watermark is only blended on its own small tile, so an
+                # RGB or RGBA canvas can be built directly in the save mode and
+                # needs no conversion afterwards.
+                work_mode = save_mode if save_mode in ("RGB", "RGBA") else "RGBA"
+            else:
+                work_mode = save_mode = original_mode
+            if img.mode != work_mode:
+                img = img.convert(work_mode)
+
             # 1. Square the image with borders
+            # The image always fits the square, so paste it onto a blank
+            # canvas rather than going through ImageOps.pad's resize path.
             max_dimension = max(img.size)
-            squared_image = ImageOps.pad(
-                img, 
-                (max_dimension, max_dimension), 
-                color=border_color, 
-                centering=(0.5, 0.5)
-            )
+            squared_image = Image.new(work_mode, (max_dimension, max_dimension), border_color)
+            if img.palette and img.getpalette() is not None:
+                squared_image.putpalette(img.getpalette())
+            squared_image.paste(img, (
+                (max_dimension - img.width) // 2,
+                (max_dimension - img.height) // 2
+            ))
             
             final_image = squared_image
 
             # 2. Add Watermark
-            if watermark_path:
+            if watermark:
                 try:
-                    # We load watermark inside worker to be safe with pickling, 
-                    # though passing a pre-loaded image is faster if shared correctly.
-                    # For simplicity and robustness in MP, we assume I/O overhead is acceptable 
-                    # or OS caches file read. 
-                    # Optimization: In a real heavy loop, we might preload or pass bytes.
-                    # Given the task, reopening the small watermark file is negligible compared to JPEG encoding.
-                    with Image.open(watermark_path) as wm_base:
-                        wm_base = wm_base.convert("RGBA")
-                        
-                        target_layer = squared_image.convert("RGBA")
-                        
-                        # Calculate size
-                        wm_target_width = int(target_layer.width * watermark_config['ratio'])
-                        
-                        # Resize watermark
-                        wm_resized = wm_base.copy()
-                        wm_resized.thumbnail((wm_target_width, wm_target_width), Image.Resampling.LANCZOS)
-                        
-                        # Apply Opacity
-                        opacity = watermark_config['opacity']
-                        if opacity < 1.0:
-                            alpha = wm_resized.getchannel('A')
-                            new_alpha = alpha.point(lambda p: int(p * opacity) if p > 0 else 0)
-                            wm_resized.putalpha(new_alpha)
-                        
-                        # Position (Bottom-Right)
-                        margin = int(target_layer.width * 0.02)
-                        position = (
-                            target_layer.width - wm_resized.width - margin,
-                            target_layer.height - wm_resized.height - margin
-                        )
-                        
-                        target_layer.paste(wm_resized, position, wm_resized)
-                        final_image = target_layer
+                    # Resize and fade watermark (cached per target width)
+                    wm_target_width, margin = _layout(final_image.width, watermark_config['ratio'])
+                    wm_resized = _prepare_watermark(
+                        watermark if isinstance(watermark, tuple) else str(watermark),
+                        wm_target_width,
+                        watermark_config['opacity']
+                    )
+                    
+                    # Position (Bottom-Right)
+                    position = (
+                        final_image.width - wm_resized.width - margin,
+                        final_image.height - wm_resized.height - margin
+                    )
+                    
+                    # Blend only the covered tile through the alpha-composite
+                    # kernel, then put it back.
+                    box = position + (position[0] + wm_resized.width, position[1] + wm_resized.height)
+                    region = final_image.crop(box)
+                    if region.mode != "RGBA":
+                        region = region.convert("RGBA")
+                    region = Image.alpha_composite(region, wm_resized)
+                    final_image.paste(region.convert(final_image.mode), position)
 
                 except Exception as wm_err:
                     logger.error(f"Failed to load watermark for {file_path.name}: {wm_err}")
                     # Continue without watermark if it fails
 
             # 3. Save
-            if final_image.mode != original_mode and original_mode != 'RGBA':
-                 # Convert back if original wasn't RGBA (unless we added alpha via watermark)
-                 # However, JPEGs don't support RGBA.
-                 if file_path.suffix.lower() in ['.jpg', '.jpeg']:
-                     final_image = final_image.convert("RGB")
-                 else:
-                     final_image = final_image.convert(original_mode)
+            if final_image.mode != save_mode:
+                if save_mode == "P" and transparency is not None:
+                    # convert("P") builds a new palette, so the source's
+                    # transparent index no longer applies; assign a fresh one
+                    final_image, transparency = _palettize_with_transparency(final_image)
+                else:
+                    final_image = final_image.convert(save_mode)
 
             new_filename = f"{file_path.stem}_1x1{file_path.suffix}"
             output_path = output_dir / new_filename
 
-            save_kwargs = metadata
-            if file_path.suffix.lower() in ['.jpg', '.jpeg']:
-                save_kwargs['quality'] = jpeg_quality
+            save_kwargs = dict(metadata)
+            if is_jpeg:
+                # Pin the fast single-pass encoder settings
+                save_kwargs.update({
+                    'quality': jpeg_quality,
+                    'optimize': False,
+                    'progressive': False,
+                })
+                # Chroma subsampling only makes sense for colour images; CMYK
+                # and greyscale keep libjpeg's default
+                if final_image.mode in ('RGB', 'YCbCr'):
+                    save_kwargs['subsampling'] = '4:2:0'
+            elif transparency is not None:
+                # A palette index is only reused if the image never left P mode
+                # (it is reassigned above otherwise); L/RGB transparency is a
+                # colour value, which survives the round trip through RGBA
+                save_kwargs['transparency'] = transparency
             
-            # Filter incompatible args for save if necessary (usually metadata is fine)
-            try:
-                final_image.save(output_path, **save_kwargs)
-            except TypeError:
-                # Fallback if metadata contains unserializable data or bad args
-                final_image.save(output_path, quality=jpeg_quality)
+            encoded = _encode_jpeg_turbo(final_image, save_kwargs) if is_jpeg else None
+            if encoded is None:
+                # Encode in memory, then write the whole file in one go
+                buffer = io.BytesIO()
+                final_image.save(buffer, format=output_format, **save_kwargs)
+                encoded = buffer.getbuffer()
+            _write_file(output_path, encoded)
 
             msg = f"Processed: {file_path.name} -> {output_path.name}"
 
@@ -155,6 +387,39 @@ def process_file(
     
     return msg
 
+def positive_int(value: str) -> int:
+    """argparse type for integers >= 1."""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be a positive integer, got {value}")
+    return number
+
+def quality_int(value: str) -> int:
+    """argparse type for JPEG quality, an integer from 1 to 100."""
+    number = int(value)
+    if not 1 <= number <= 100:
+        raise argparse.ArgumentTypeError(f"must be between 1 and 100, got {value}")
+    return number
+
+def _prefetch_files(paths: list, out_queue: queue.Queue) -> None:
+    """
+    Reads files ahead of the workers so disk I/O overlaps with encoding.
+    Puts (path, bytes) pairs on the bounded queue, then None when done.
+    Any unexpected error is put on the queue instead of None, so the
+    consumer never waits on a reader that has died.
+    """
+    try:
+        for p in paths:
+            try:
+                data = p.read_bytes()
+            except OSError:
+                data = None  # Let the worker open it and report the error
+            out_queue.put((p, data))
+    except BaseException as e:
+        out_queue.put(e)
+    else:
+        out_queue.put(None)
+
 def main():
     parser = argparse.ArgumentParser(
         description="Batch process images: Add borders to make square (1x1), optionally watermark, and preserve metadata."
@@ -172,7 +437,8 @@ def main():
     parser.add_argument("--color", default="white", help="Border color (name or hex, default: white)")
     parser.add_argument("--opacity", type=float, default=0.6, help="Watermark opacity (0.0 - 1.0, default: 0.6)")
     parser.add_argument("--ratio", type=float, default=0.15, help="Watermark size ratio relative to image width (default: 0.15)")
-    parser.add_argument("--quality", type=int, default=95, help="JPEG quality (1-100, default: 95)")
+    parser.add_argument("--quality", type=quality_int, default=95, help="JPEG quality (1-100, default: 95)")
+    parser.add_argument("--max-edge", type=positive_int, default=None, help="Downscale so the longest edge is at most this many pixels (default: keep original size)")
     parser.add_argument("--workers", type=int, default=None, help="Number of parallel workers (default: CPU count)")
 
     args = parser.parse_args()
@@ -195,16 +461,28 @@ def main():
         sys.exit(1)
 
     # Collect Files
-    files_to_process = [
-        p for p in input_path.iterdir() 
-        if p.suffix.lower() in SUPPORTED_EXTENSIONS and "_1x1" not in p.stem
-    ]
+    # scandir yields DirEntry objects with a cached name and file type
+    extensions = tuple(SUPPORTED_EXTENSIONS)
+    with os.scandir(input_path) as entries:
+        files_to_process = [
+            Path(e.path) for e in entries
+            if e.is_file() and e.name.lower().endswith(extensions) and "_1x1" not in e.name
+        ]
 
     if not files_to_process:
         logger.info(f"No valid images found in {input_path}")
         sys.exit(0)
 
     logger.info(f"Found {len(files_to_process)} images in {input_path}")
+    simd_note = " (SIMD build)" if ".post" in PIL.__version__ else ""
+    logger.info(f"Using Pillow {PIL.__version__}{simd_note}")
+    if _get_turbojpeg() is not None:
+        logger.info("Encoding JPEGs with libjpeg-turbo (PyTurboJPEG)")
+    elif TurboJPEG is not None:
+        logger.info("Encoding JPEGs with Pillow: PyTurboJPEG is installed but libturbojpeg "
+                    "could not be loaded (PyTurboJPEG 2.x needs libjpeg-turbo >= 3.0)")
+    else:
+        logger.info("Encoding JPEGs with Pillow")
     if args.delete_originals:
         logger.warning("WARNING: Original files will be deleted after processing.")
 
@@ -213,27 +491,68 @@ def main():
         'opacity': args.opacity
     }
 
+    # Decode the watermark once here and let workers map it from shared memory
+    watermark = watermark_path
+    watermark_shm = None
+    if watermark_path and np is not None:
+        try:
+            watermark_shm, watermark = _share_watermark(watermark_path)
+        except OSError as wm_err:
+            logger.error(f"Could not share watermark, workers will load it: {wm_err}")
+
     # Parallel Processing
+    # A reader thread prefetches file bytes while workers encode. Both the
+    # queue and the number of in-flight tasks are bounded to cap memory.
+    num_workers = args.workers or os.cpu_count() or 1
+    if sys.platform == "win32" and not args.workers:
+        # Match ProcessPoolExecutor's own default, which Windows caps at 61
+        num_workers = min(num_workers, 61)
+    max_in_flight = 2 * num_workers
+    prefetched = queue.Queue(maxsize=max_in_flight)
+    threading.Thread(
+        target=_prefetch_files, args=(files_to_process, prefetched), daemon=True
+    ).start()
+
+    # Bind the arguments shared by every file once
+    process_one = functools.partial(
+        process_file,
+        output_dir=output_path,
+        watermark=watermark,
+        watermark_config=watermark_config,
+        border_color=args.color,
+        jpeg_quality=args.quality,
+        delete_original=args.delete_originals,
+        max_edge=args.max_edge
+    )
+
     results = []
-    with ProcessPoolExecutor(max_workers=args.workers) as executor:
-        futures = {
-            executor.submit(
-                process_file, 
-                p, 
-                output_path, 
-                watermark_path, 
-                watermark_config, 
-                args.color, 
-                args.quality, 
-                args.delete_originals
-            ): p for p in files_to_process
-        }
-        
-        for future in as_completed(futures):
+
+    def collect(done):
+        for future in done:
             result = future.result()
             results.append(result)
             logger.info(result)
 
+    try:
+        with ProcessPoolExecutor(max_workers=num_workers) as executor:
+            # Submit through a bounded window rather than all at once, so huge
+            # folders never hold more than max_in_flight pending tasks.
+            in_flight = set()
+            while (item := prefetched.get()) is not None:
+                if isinstance(item, BaseException):
+                    raise item
+                p, data = item
+                in_flight.add(executor.submit(process_one, p, file_bytes=data))
+                if len(in_flight) >= max_in_flight:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    collect(done)
+
+            collect(as_completed(in_flight))
+    finally:
+        if watermark_shm is not None:
+            watermark_shm.close()
+            watermark_shm.unlink()
+
     logger.info("\nBatch processing complete.")
 
 if __name__ == "__main__":